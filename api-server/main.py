@@ -2,6 +2,7 @@ import os
 import tiktoken
 import requests
 import datetime
+import functools
 
 from dateutil.relativedelta import relativedelta
 from requests.exceptions import HTTPError
@@ -12,13 +13,14 @@ from starlette.responses import FileResponse
 from gunicorn.app.base import BaseApplication
 from prometheus_fastapi_instrumentator import Instrumentator
 
-from sqlalchemy import or_, select, create_engine
-from sqlalchemy.orm import sessionmaker, scoped_session, load_only
+from sqlalchemy import or_, select, text, bindparam, literal_column
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import load_only, selectinload
 from typing import List, Optional
 
 
 import utils
-from search import search
+from search import search, close_http_client
 from schema import *
 
 # Database connection
@@ -43,30 +45,50 @@ def check_basic_auth(credentials: HTTPBasicCredentials = Depends(security)):
         raise HTTPException(status_code=401, detail="Unauthorized")
 
 
-# SQLachemy setup
-engine = create_engine(
-    f"sqlite:///{DB_PATH}?mode=ro",
-    connect_args={"check_same_thread": False},
+# SQLachemy setup. Handlers are async, so the engine is async too: the event
+# loop keeps serving other requests while a DB round-trip is in flight.
+engine = create_async_engine(
+    f"sqlite+aiosqlite:///{DB_PATH}?mode=ro",
     echo=False,
 )
-session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-scoped_session = scoped_session(session_factory)
-Base.metadata.create_all(bind=engine)
+session_factory = async_sessionmaker(
+    engine, autoflush=False, expire_on_commit=False
+)
 app = FastAPI()
 app = utils.initialize_middleware(app)
 instrumentator = Instrumentator().instrument(app)
 
+# Whether the snapshot carries the items_fts full-text index. Newer
+# hn-to-sqlite builds create it; older snapshots fall back to LIKE scans.
+has_fts = False
+
 # API endpoints
 
 
 @app.on_event("startup")
 async def _startup():
+    global has_fts
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        has_fts = (
+            await conn.execute(
+                text(
+                    "SELECT 1 FROM sqlite_master "
+                    "WHERE type = 'table' AND name = 'items_fts'"
+                )
+            )
+        ).first() is not None
     if PASSWD is not None:
         instrumentator.expose(
             app, include_in_schema=False, dependencies=[Depends(check_basic_auth)]
         )
 
 
+@app.on_event("shutdown")
+async def _shutdown():
+    await close_http_client()
+
+
 @app.get("/.well-known/ai-plugin.json", include_in_schema=False)
 def get_plugin():
     return FileResponse("static/ai-plugin.json")
@@ -93,31 +115,119 @@ def get_root():
 
 
 @app.get("/item", response_model=FullItemResponse, response_model_exclude_none=True)
-def get_item(id: int = Query(1), verbosity: Verbosity = Verbosity.short):
-    session = scoped_session()
+async def get_item(id: int = Query(1), verbosity: Verbosity = Verbosity.short):
+    async with session_factory() as session:
+        if verbosity == Verbosity.full:
+            # Eager-load the whole comment tree with batched IN queries (one
+            # per level) instead of one lazy load per item during serialization
+            item_stmt = (
+                select(FullItem)
+                .options(selectinload(FullItem.kids, recursion_depth=-1))
+                .where(FullItem.id == id)
+            )
+        else:
+            item_stmt = select(Item).where(Item.id == id)
 
-    if verbosity == Verbosity.full:
-        item_query = session.query(FullItem).filter(FullItem.id == id)
-    else:
-        item_query = session.query(Item).filter(Item.id == id)
+        item = (await session.execute(item_stmt)).scalars().first()
+        if item is None:
+            raise HTTPException(status_code=404, detail="Item not found")
+
+        if verbosity == Verbosity.short:
+            item.top_comments = await utils.get_comments_text(
+                session, item.id, x_top=5
+            )
 
-    item = item_query.first()
-    if item is None:
-        raise HTTPException(status_code=404, detail="Item not found")
+        # If item_type was poll, also add pollopts
+        if item.type == ItemType.poll.value:
+            items = await utils.get_poll_responses(session, [item])
+            item = items[0]
+
+        return item
+
+
+# get_items assembles the same handful of statement shapes over and over, so
+# each shape is built once, keyed on which predicates are present plus the
+# sort, and values flow in through bindparams at execution time
+@functools.lru_cache(maxsize=256)
+def _items_stmt(
+    exclude_text,
+    has_type,
+    has_by,
+    has_before_time,
+    has_after_time,
+    has_min_score,
+    has_max_score,
+    has_min_comments,
+    has_max_comments,
+    text_match,
+    sort_by,
+    sort_order,
+):
+    stmt = select(Item)
+
+    if exclude_text:
+        stmt = stmt.options(
+            load_only(
+                Item.id,
+                Item.type,
+                Item.by,
+                Item.time,
+                Item.url,
+                Item.score,
+                Item.title,
+                Item.descendants,
+            )
+        )
+    if has_type:
+        stmt = stmt.where(Item.type == bindparam("item_type"))
 
-    if verbosity == Verbosity.short:
-        item.top_comments = utils.get_comments_text(session, item.id, x_top=5)
+    # Filtering
+    if has_by:
+        stmt = stmt.where(Item.by == bindparam("by"))
+    if has_before_time:
+        stmt = stmt.where(Item.time <= bindparam("before_time"))
+    if has_after_time:
+        stmt = stmt.where(Item.time >= bindparam("after_time"))
+    if has_min_score:
+        stmt = stmt.where(Item.score >= bindparam("min_score"))
+    if has_max_score:
+        stmt = stmt.where(Item.score <= bindparam("max_score"))
+    if has_min_comments:
+        stmt = stmt.where(Item.descendants >= bindparam("min_comments"))
+    if has_max_comments:
+        stmt = stmt.where(Item.descendants <= bindparam("max_comments"))
+
+    # Text matching: the full-text index when the snapshot has one, LIKE
+    # contains otherwise
+    if text_match == "fts":
+        stmt = stmt.where(
+            Item.id.in_(
+                select(literal_column("rowid"))
+                .select_from(text("items_fts"))
+                .where(text("items_fts MATCH :fts_query"))
+            )
+        )
+    elif text_match == "like":
+        stmt = stmt.where(
+            or_(
+                Item.title.contains(bindparam("like_query")),
+                Item.text.contains(bindparam("like_query")),
+            )
+        )
 
-    # If item_type was poll, also add pollopts
-    if item.type == ItemType.poll.value:
-        items = utils.get_poll_responses(session, [item])
-        item = items[0]
+    # Sorting
+    sort_column = getattr(Item, sort_by.value)
+    if sort_order == SortOrder.asc:
+        stmt = stmt.order_by(sort_column.asc())
+    elif sort_order == SortOrder.desc:
+        stmt = stmt.order_by(sort_column.desc())
 
-    return item
+    # Limit & skip
+    return stmt.offset(bindparam("skip")).limit(bindparam("limit"))
 
 
 @app.get("/items", response_model=List[ItemResponse], response_model_exclude_none=True)
-def get_items(
+async def get_items(
     item_type: ItemType = ItemType.story,
     query: Optional[str] = Query(None),
     exclude_text: Optional[bool] = False,
@@ -150,114 +260,111 @@ def get_items(
         )
         after_time = lower_bound.timestamp()
 
-    session = scoped_session()
-
     if query is not None:
         query = " ".join(query.lower().split())
 
-    # If query is not empty and type is story or comments, go the semantic search route
-    if query is not None and item_type in [ItemType.story, ItemType.comment]:
-        return jsonable_encoder(
-            search(
-                DATA_SERVER,
-                session,
-                query,
-                exclude_text,
-                by,
-                before_time,
-                after_time,
-                min_score,
-                max_score,
-                min_comments,
-                max_comments,
-                sort_by,
-                sort_order,
-                skip,
-                limit,
-                with_answer,
+    async with session_factory() as session:
+        # If query is not empty and type is story or comments, go the semantic search route
+        if query is not None and item_type in [ItemType.story, ItemType.comment]:
+            return jsonable_encoder(
+                await search(
+                    DATA_SERVER,
+                    session,
+                    query,
+                    exclude_text,
+                    by,
+                    before_time,
+                    after_time,
+                    min_score,
+                    max_score,
+                    min_comments,
+                    max_comments,
+                    sort_by,
+                    sort_order,
+                    skip,
+                    limit,
+                    with_answer,
+                )
             )
-        )
-
-    # Set type and don't load any children by default
-    items_query = session.query(Item)
-
-    if exclude_text:
-        fields = [
-            Item.id,
-            Item.type,
-            Item.by,
-            Item.time,
-            Item.url,
-            Item.score,
-            Item.title,
-            Item.descendants,
-        ]
-        items_query = items_query.options(load_only(*fields))
-    if item_type is not None:
-        items_query = items_query.filter(Item.type == item_type.value)
-
-    # Filtering
-    if by is not None:
-        items_query = items_query.filter(Item.by == by)
-    if before_time is not None:
-        items_query = items_query.filter(Item.time <= before_time)
-    if after_time is not None:
-        items_query = items_query.filter(Item.time >= after_time)
-    if min_score is not None:
-        items_query = items_query.filter(Item.score >= min_score)
-    if max_score is not None:
-        items_query = items_query.filter(Item.score <= max_score)
-    if min_comments is not None:
-        items_query = items_query.filter(Item.descendants >= min_comments)
-    if max_comments is not None:
-        items_query = items_query.filter(Item.descendants <= max_comments)
-
-    # If query is set but type is 'poll' or 'job', just use contains
-    if query is not None:
-        items_query = items_query.filter(
-            or_(Item.title.contains(query), Item.text.contains(query))
-        )
 
-    # Sorting
-    if sort_by is not None:
+        # Relevance degrades to score for plain listings
         if sort_by == SortBy.relevance:
             sort_by = SortBy.score
-        sort_column = getattr(Item, sort_by.value)
-        if sort_order == SortOrder.asc:
-            items_query = items_query.order_by(sort_column.asc())
-        elif sort_order == SortOrder.desc:
-            items_query = items_query.order_by(sort_column.desc())
 
-    # Limit & skip
-    items_query = items_query.offset(skip).limit(limit)
-    results = items_query.all()
+        # Collect the present predicates and their values; the statement
+        # itself comes prebuilt from the shape cache
+        params = {"skip": skip, "limit": limit}
+        if item_type is not None:
+            params["item_type"] = item_type.value
+        if by is not None:
+            params["by"] = by
+        if before_time is not None:
+            params["before_time"] = before_time
+        if after_time is not None:
+            params["after_time"] = after_time
+        if min_score is not None:
+            params["min_score"] = min_score
+        if max_score is not None:
+            params["max_score"] = max_score
+        if min_comments is not None:
+            params["min_comments"] = min_comments
+        if max_comments is not None:
+            params["max_comments"] = max_comments
+
+        # If query is set but type is 'poll' or 'job', match text too
+        text_match = None
+        if query is not None:
+            if has_fts:
+                text_match = "fts"
+                # Quote as a phrase so FTS operators in user input are literal
+                params["fts_query"] = '"' + query.replace('"', '""') + '"'
+            else:
+                text_match = "like"
+                params["like_query"] = query
+
+        items_stmt = _items_stmt(
+            bool(exclude_text),
+            item_type is not None,
+            by is not None,
+            before_time is not None,
+            after_time is not None,
+            min_score is not None,
+            max_score is not None,
+            min_comments is not None,
+            max_comments is not None,
+            text_match,
+            sort_by,
+            sort_order,
+        )
+        results = (await session.execute(items_stmt, params)).scalars().all()
 
-    # If item_type was poll, also add pollopts
-    if item_type == ItemType.poll:
-        results = utils.get_poll_responses(session, results)
+        # If item_type was poll, also add pollopts
+        if item_type == ItemType.poll:
+            results = await utils.get_poll_responses(session, results)
 
-    # Add top_comments if needed
-    if not exclude_text:
-        results = utils.with_top_comments(session, results)
+        # Add top_comments if needed
+        if not exclude_text:
+            results = await utils.with_top_comments(session, results)
 
-    # Add answer if needed
-    if with_answer:
-        results = utils.with_answer(session, query, results)
+        # Add answer if needed
+        if with_answer:
+            results = await utils.with_answer(session, query, results)
 
-    return jsonable_encoder(results)
+        return jsonable_encoder(results)
 
 
 @app.get("/user", response_model=UserResponse)
-def get_user(id: str = Query("pg")):
-    session = scoped_session()
-    user = session.query(User).filter(User.id == id).first()
-    if user is None:
-        raise HTTPException(status_code=404, detail="User not found")
-    return user
+async def get_user(id: str = Query("pg")):
+    async with session_factory() as session:
+        user_stmt = select(User).where(User.id == id)
+        user = (await session.execute(user_stmt)).scalars().first()
+        if user is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        return user
 
 
 @app.get("/users", response_model=List[UserResponse])
-def get_users(
+async def get_users(
     before_created: Optional[str] = None,
     after_created: Optional[str] = None,
     min_karma: Optional[int] = None,
@@ -276,8 +383,6 @@ def get_users(
     if after_created:
         after_created = utils.parse_human_time(after_created)
 
-    session = scoped_session()
-
     # Select columns except submitted
     columns = [User.id, User.created, User.karma, User.about]
     user_select = select(*columns)
@@ -300,7 +405,8 @@ def get_users(
         user_select = user_select.order_by(sort_column.desc())
 
     user_select = user_select.offset(skip).limit(limit)
-    return session.execute(user_select).fetchall()
+    async with session_factory() as session:
+        return (await session.execute(user_select)).fetchall()
 
 
 class UvicornGunicornApplication(BaseApplication):
@@ -3,7 +3,7 @@ import json
 import datetime
 
 from typing import Optional, List
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Table
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Table, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from pydantic import BaseModel, Field, validator
@@ -13,31 +13,31 @@ from fastapi.openapi.utils import get_openapi
 Base = declarative_base()
 
 
-class ItemType(enum.Enum):
+class ItemType(str, enum.Enum):
     story = "story"
     comment = "comment"
     poll = "poll"
     job = "job"
 
 
-class SortBy(enum.Enum):
+class SortBy(str, enum.Enum):
     relevance = "relevance"
     score = "score"
     time = "time"
     descendants = "descendants"
 
 
-class UserSortBy(enum.Enum):
+class UserSortBy(str, enum.Enum):
     created = "created"
     karma = "karma"
 
 
-class SortOrder(enum.Enum):
+class SortOrder(str, enum.Enum):
     asc = "asc"
     desc = "desc"
 
 
-class Verbosity(enum.Enum):
+class Verbosity(str, enum.Enum):
     full = "full"
     none = "none"
     short = "short"
@@ -45,6 +45,13 @@ class Verbosity(enum.Enum):
 
 class Item(Base):
     __tablename__ = "items"
+    # Composite indexes matching the get_items filter/sort predicates, so
+    # type-restricted listings are index range scans instead of full scans
+    __table_args__ = (
+        Index("ix_items_type_score", "type", "score"),
+        Index("ix_items_type_time", "type", "time"),
+        Index("ix_items_by", "by"),
+    )
     id = Column(Integer, primary_key=True)
     deleted = Column(Boolean)
     type = Column(String)
@@ -76,6 +83,9 @@ story_comments = Table(
     Column("item", Integer, ForeignKey("items.id")),
     Column("kid", Integer, ForeignKey("items.id")),
     Column("display_order", Integer),
+    # Lets the ORDER BY display_order in comment fetches come straight off
+    # the index without a sort step
+    Index("ix_kids_item_order", "item", "display_order"),
 )
 
 
@@ -1,15 +1,68 @@
 import time
-import requests
+import httpx
+import asyncio
+import functools
+import collections
+import numpy as np
 
 from sqlalchemy import and_
-from sqlalchemy.sql import text
+from sqlalchemy.sql import text, select
 from sqlalchemy.orm import load_only
 
 import utils
 from schema import *
 
+# Fetch ranking metadata for all candidate stories in one round-trip, with
+# min/max normalization of score, age, and search distance pushed into SQLite
+# window aggregates. The candidate (id, distance) pairs are joined in via a
+# VALUES CTE; the statement shape only depends on the candidate count, so the
+# handful of top_k sizes in use compile once and are reused.
+@functools.lru_cache(maxsize=8)
+def _ranking_stmt(num_candidates):
+    values = ", ".join(f"(:id{i}, :d{i})" for i in range(num_candidates))
+    return text(
+        f"""WITH cand(id, distance) AS (VALUES {values}),
+            expanded AS (
+                SELECT i.id AS id, i.title AS title,
+                       CAST(COALESCE(i.score, 1) AS REAL) AS score,
+                       CAST(COALESCE(i.time, 0) AS REAL) AS age,
+                       CAST(c.distance AS REAL) AS distance
+                FROM cand c JOIN items i ON i.id = c.id
+                WHERE i.title IS NOT NULL
+            )
+            SELECT id, title,
+                   CASE WHEN MAX(score) OVER () = MIN(score) OVER () THEN 1.0
+                        ELSE (score - MIN(score) OVER ())
+                             / (MAX(score) OVER () - MIN(score) OVER ()) END,
+                   CASE WHEN MAX(age) OVER () = MIN(age) OVER () THEN 1.0
+                        ELSE (age - MIN(age) OVER ())
+                             / (MAX(age) OVER () - MIN(age) OVER ()) END,
+                   CASE WHEN MAX(distance) OVER () = MIN(distance) OVER () THEN 0.0
+                        ELSE 1.0 - (distance - MIN(distance) OVER ())
+                             / (MAX(distance) OVER () - MIN(distance) OVER ()) END
+            FROM expanded"""
+    )
+
+# Shared keepalive client so repeat searches reuse pooled connections to the
+# data server instead of paying a TCP handshake per query
+_http_client = None
+
+
+def get_http_client():
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient()
+    return _http_client
+
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
 
-def search_results(
+
+async def search_results(
     session,
     ids,
     top_k,
@@ -23,10 +76,10 @@ def search_results(
 ):
     expand = time.time()
     limit_ids = ids[skip : skip + limit]
-    filtered = session.query(Item).filter(Item.id.in_(limit_ids))
+    filtered_stmt = select(Item).where(Item.id.in_(limit_ids))
 
     if exclude_text:
-        filtered = filtered.options(
+        filtered_stmt = filtered_stmt.options(
             load_only(
                 *[
                     Item.id,
@@ -39,11 +92,15 @@ def search_results(
                     Item.descendants,
                 ]
             )
-        ).all()
+        )
+        filtered = (await session.execute(filtered_stmt)).scalars().all()
     else:
-        filtered = utils.with_top_comments(session, filtered.all())
+        filtered = (await session.execute(filtered_stmt)).scalars().all()
+        filtered = await utils.with_top_comments(session, filtered)
 
-    ordered_items = sorted(filtered, key=lambda item: limit_ids.index(item.id))
+    # Restore ranking order with a dict lookup per item
+    by_id = {item.id: item for item in filtered}
+    ordered_items = [by_id[sid] for sid in limit_ids if sid in by_id]
     expand = time.time() - expand
     times["fetch_time"] += expand
 
@@ -58,11 +115,11 @@ def search_results(
     print(log_msg)
 
     if with_answer:
-        ordered_items = utils.with_answer(session, query, ordered_items)
+        ordered_items = await utils.with_answer(session, query, ordered_items)
     return ordered_items
 
 
-def search(
+async def search(
     url,
     session,
     query,
@@ -97,11 +154,15 @@ def search(
     if max_comments:
         query_filters.append(Item.descendants <= max_comments)
 
-    # Perform semantic search
+    # Perform semantic search. When no filters or re-sorts apply, only the
+    # first skip+limit ranked ids are ever used, so rank just those.
     top_k = 100
+    top_n = None
     if len(query_filters) > 0:
         top_k = 1000
-    results = semantic_search(url, session, query, top_k=top_k)
+    elif sort_by == SortBy.relevance:
+        top_n = skip + limit
+    results = await semantic_search(url, session, query, top_k=top_k, top_n=top_n)
     ids = [story_id for _, story_id in results["results"]]
     times = {
         "search_time": results["search_time"],
@@ -111,29 +172,30 @@ def search(
 
     # See if we can early return
     if len(query_filters) == 0 and sort_by == SortBy.relevance:
-        return search_results(
+        return await search_results(
             session, ids, top_k, skip, limit, query, times, exclude_text, with_answer
         )
 
     # Apply filters if necessary
     times["fetch_time"] = time.time()
     query_filters.append(Item.id.in_(ids))
-    filter_query = session.query(Item.id).filter(and_(*query_filters))
+    filter_stmt = select(Item.id).where(and_(*query_filters))
 
     # Sort results
     if sort_by != SortBy.relevance:
         sort_column = getattr(Item, sort_by.value)
         if sort_order == SortOrder.asc:
-            filter_query = filter_query.order_by(sort_column.asc())
+            filter_stmt = filter_stmt.order_by(sort_column.asc())
         elif sort_order == SortOrder.desc:
-            filter_query = filter_query.order_by(sort_column.desc())
+            filter_stmt = filter_stmt.order_by(sort_column.desc())
 
-    filtered = filter_query.all()
+    filtered = (await session.execute(filter_stmt)).fetchall()
     if sort_by == SortBy.relevance:
-        filtered = sorted(filtered, key=lambda item: ids.index(item.id))
+        rank = {sid: i for i, sid in enumerate(ids)}
+        filtered = sorted(filtered, key=lambda item: rank[item.id])
     times["fetch_time"] = time.time() - times["fetch_time"]
     filtered_ids = [item[0] for item in filtered]
-    return search_results(
+    return await search_results(
         session,
         filtered_ids,
         top_k,
@@ -147,18 +209,39 @@ def search(
     )
 
 
-def semantic_search(url, session, query, top_k=100):
+# Last candidate set the data server returned per (query, top_k), so repeat
+# queries can overlap ranking DB work with the search round-trip
+CANDIDATE_CACHE = collections.OrderedDict()
+MAX_CANDIDATE_CACHE_SIZE = 1024
+
+
+async def semantic_search(url, session, query, top_k=100, top_n=None):
     query = query.strip()
 
-    # Perform semantic search
+    # Perform semantic search. If we have seen this query before,
+    # speculatively rank the previous candidates while the request is in
+    # flight: when the data server returns the same set, the ranking pass
+    # below is a warm cache hit instead of a serial DB round-trip.
     start = time.time()
-    req = requests.get(url, params={"query": query, "top_k": top_k})
+    http_req = get_http_client().get(url, params={"query": query, "top_k": top_k})
+    candidates = CANDIDATE_CACHE.get((query, top_k))
+    if candidates is not None:
+        req, _ = await asyncio.gather(
+            http_req, compute_rankings(session, query, candidates, top_n=top_n)
+        )
+    else:
+        req = await http_req
     results = req.json()
     search_time = time.time() - start
 
+    CANDIDATE_CACHE[(query, top_k)] = results
+    CANDIDATE_CACHE.move_to_end((query, top_k))
+    if len(CANDIDATE_CACHE) > MAX_CANDIDATE_CACHE_SIZE:
+        CANDIDATE_CACHE.popitem(last=False)
+
     # Rank results
     start = time.time()
-    results = compute_rankings(session, query, results)
+    results = await compute_rankings(session, query, results, top_n=top_n)
     rank_time = time.time() - start
 
     return {
@@ -168,43 +251,43 @@ def semantic_search(url, session, query, top_k=100):
     }
 
 
-def normalize(values, reverse=False):
-    min_val = min(values)
-    max_val = max(values)
-    if max_val == min_val:
-        normalized_values = [0 if reverse else 1] * len(values)
-    else:
-        normalized_values = [
-            (value - min_val) / (max_val - min_val) for value in values
-        ]
-        if reverse:
-            normalized_values = [1 - value for value in normalized_values]
-    return normalized_values
-
-
-def compute_rankings(session, query, results):
-    expanded = []
-    for story_id, distance in results:
-        cursor = session.execute(
-            text(f"SELECT title, score, time FROM items WHERE id = {story_id}")
-        ).cursor
-        story_data = cursor.fetchone()
-        if story_data is None:
-            continue
-        title, score, age = story_data[0], story_data[1], story_data[2]
-        if title is None:
-            continue
-        score = 1 if score is None else score
-        age = 0 if age is None else age
-        expanded.append((story_id, distance, title, score, age))
-        cursor.close()
-
-    scores, ages, distances = zip(
-        *[(score, age, distance) for _, distance, _, score, age in expanded]
-    )
-    normalized_scores = normalize(scores)
-    normalized_ages = normalize(ages)
-    normalized_distances = normalize(distances, reverse=True)
+# ChatGPT fan-out tends to repeat the same query over the same candidates in
+# quick succession; cache ranked results briefly so repeats skip the DB. The
+# TTL keeps rankings from going stale as scores change under realtime sync.
+RANKING_CACHE = collections.OrderedDict()
+MAX_RANKING_CACHE_SIZE = 1024
+RANKING_CACHE_TTL = 60  # seconds
+
+
+async def compute_rankings(session, query, results, top_n=None):
+    if not results:
+        return []
+
+    cache_key = (query, top_n, tuple(tuple(pair) for pair in results))
+    cached = RANKING_CACHE.get(cache_key)
+    if cached is not None:
+        stamp, rankings = cached
+        if time.time() - stamp < RANKING_CACHE_TTL:
+            RANKING_CACHE.move_to_end(cache_key)
+            return rankings
+        del RANKING_CACHE[cache_key]
+
+    # One query fetches every candidate's title and its already-normalized
+    # score, age, and distance. The topicality bonus needs the query string,
+    # so it stays in Python.
+    params = {}
+    for i, (story_id, distance) in enumerate(results):
+        params[f"id{i}"] = story_id
+        params[f"d{i}"] = distance
+    rows = (await session.execute(_ranking_stmt(len(results)), params)).fetchall()
+    if not rows:
+        return []
+
+    ids = [row[0] for row in rows]
+    normalized = np.asarray([row[2:5] for row in rows], dtype=np.float64)
+    normalized_scores = normalized[:, 0]
+    normalized_ages = normalized[:, 1]
+    normalized_distances = normalized[:, 2]
 
     w1, w2, w3, w4 = 0.2, 0.25, 0.35, 0.2
 
@@ -216,18 +299,29 @@ def compute_rankings(session, query, results):
                 topicality += 1 / (i + 1)
         return topicality
 
-    rankings = []
-    for i, (story_id, distance, title, _, _) in enumerate(expanded):
-        query_words = set(word.lower() for word in query.split())
-        title_words = [word.lower() for word in title.split()]
-        topicality = calculate_topicality(query_words, title_words)
-
-        score_rank = (
-            w1 * normalized_scores[i]
-            + w2 * normalized_distances[i]
-            + w3 * normalized_ages[i]
-            + w4 * topicality
-        )
-        rankings.append((score_rank, story_id))
+    # The query tokens are invariant across candidates, so build them once
+    query_words = frozenset(query.lower().split())
+    topicality = np.asarray(
+        [calculate_topicality(query_words, row[1].lower().split()) for row in rows],
+        dtype=np.float64,
+    )
+
+    # Weighted blend as one vector expression over all candidates
+    score_rank = (
+        w1 * normalized_scores
+        + w2 * normalized_distances
+        + w3 * normalized_ages
+        + w4 * topicality
+    )
+    if top_n is not None and top_n < len(score_rank):
+        # O(N) partial selection of the top candidates, then sort just those
+        top = np.argpartition(-score_rank, top_n)[:top_n]
+        order = top[np.argsort(-score_rank[top])]
+    else:
+        order = np.argsort(-score_rank)
+    rankings = [(score_rank[i], ids[i]) for i in order]
 
-    return sorted(rankings, reverse=True)
+    RANKING_CACHE[cache_key] = (time.time(), rankings)
+    if len(RANKING_CACHE) > MAX_RANKING_CACHE_SIZE:
+        RANKING_CACHE.popitem(last=False)
+    return rankings
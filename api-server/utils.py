@@ -2,12 +2,15 @@ import os
 import copy
 import time
 import openai
+import asyncio
 import logging
 import tiktoken
+import itertools
 import dateparser
 import collections
 
-from sqlalchemy.sql import text
+from sqlalchemy.sql import text, bindparam, select
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from asgi_logger import AccessLoggerMiddleware
 
@@ -30,6 +33,9 @@ EXAMPLE_QUESTIONS = [
     "effective strategies for overcoming procrastination",
 ]
 
+# Give up on any request that takes longer than this (seconds)
+REQUEST_TIMEOUT = 10
+
 # OpenAI constants
 ENCODER_NAME = "cl100k_base"
 TOKEN_LIMIT = 3840  # 4096-256, leave 256 for answer and user query
@@ -49,6 +55,40 @@ def example_questions(as_json=False):
     return EXAMPLE_QUESTIONS
 
 
+# Pure ASGI middleware, not BaseHTTPMiddleware: the downstream app runs in
+# this same task, so the timeout's cancellation actually reaches the handler
+# at the deadline. asyncio.timeout is a single TimerHandle on 3.11+, with no
+# extra Task or Future per request.
+class TimeoutMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        response_started = False
+
+        async def send_wrapper(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            async with asyncio.timeout(REQUEST_TIMEOUT):
+                await self.app(scope, receive, send_wrapper)
+        except TimeoutError:
+            # Too late for a 408 once the response has started streaming
+            if response_started:
+                raise
+            response = JSONResponse(
+                status_code=408, content={"detail": "Request timed out"}
+            )
+            await response(scope, receive, send)
+
+
 def initialize_middleware(app):
     def set_schema():
         if app.openapi_schema:
@@ -58,6 +98,8 @@ def initialize_middleware(app):
 
     app.openapi = set_schema
 
+    app.add_middleware(TimeoutMiddleware)
+
     logging.getLogger("uvicorn.access").handlers = []
     app.add_middleware(
         AccessLoggerMiddleware, format='%(h)s - %(s)s %(M)sms - "%(request_line)s"'
@@ -93,7 +135,7 @@ def parse_human_time(time_str):
     return None
 
 
-def with_top_comments(session, items):
+async def with_top_comments(session, items):
     x_top = 2
     n_child = 1
     if len(items) > 3:
@@ -106,12 +148,15 @@ def with_top_comments(session, items):
         x_top = 0
         n_child = 0
 
+    top_comments = await get_comments_text_batch(
+        session, [item.id for item in items], x_top, n_child
+    )
     for item in items:
-        item.top_comments = get_comments_text(session, item.id, x_top, n_child)
+        item.top_comments = top_comments.get(item.id, [])
     return items
 
 
-def with_answer(session, query, items):
+async def with_answer(session, query, items):
     if os.environ.get("OPENAI_API_KEY") is None:
         return items
     if query in OAI_CACHE:
@@ -137,7 +182,7 @@ def with_answer(session, query, items):
         if remaining_tokens <= 0:
             break
 
-        comments = get_comments_text(session, item.id, x_top=5, n_child=0)
+        comments = await get_comments_text(session, item.id, x_top=5, n_child=0)
         for comment in comments:
             comment_token_count = num_tokens(comment)
             if remaining_tokens >= comment_token_count:
@@ -156,7 +201,7 @@ def with_answer(session, query, items):
     prompt += f"\n\nAnswer the following question: {query}?"
 
     start = time.time()
-    resp = openai.ChatCompletion.create(
+    resp = await openai.ChatCompletion.acreate(
         model="gpt-3.5-turbo",
         messages=[
             {
@@ -180,54 +225,90 @@ def with_answer(session, query, items):
     return items
 
 
+# Single grouped query for the first few kid comments across any number of
+# parents. ROW_NUMBER caps rows per parent server-side, so heavily-commented
+# stories don't ship their whole thread over just to keep the top handful.
+# The parent id is aliased so it doesn't collide with items.parent.
+_KID_COMMENTS_BATCH = text(
+    """SELECT * FROM (
+            SELECT i.*, k.item AS parent_item,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY k.item ORDER BY k.display_order
+                   ) AS display_rank
+            FROM items i
+            JOIN kids k ON i.id = k.kid
+            WHERE k.item IN :parent_ids AND i.type = 'comment'
+        )
+        WHERE display_rank <= :per_parent
+        ORDER BY parent_item, display_rank"""
+).bindparams(bindparam("parent_ids", expanding=True))
+
+
+async def _fetch_kid_comments(session, parent_ids, per_parent):
+    result = await session.execute(
+        _KID_COMMENTS_BATCH,
+        {"parent_ids": list(parent_ids), "per_parent": per_parent},
+    )
+    # Dict-like rows straight from the driver; no per-row ORM hydration
+    comments = {}
+    for parent_id, group in itertools.groupby(
+        result.mappings(), key=lambda row: row["parent_item"]
+    ):
+        comments[parent_id] = list(group)
+    return comments
+
+
 # Top 'x' kid comments, and 'n' child comment of each top-level comment from the database
 # TODO: limit to word count instead of comment count and find smarter way to rank
-def get_comments_text(session, story_id, x_top=3, n_child=1):
-    comment_text = []
-    cursor = session.execute(
-        text(
-            f"""SELECT i.* FROM items i
-                    JOIN kids k ON i.id = k.kid
-                    WHERE k.item = {story_id} AND i.type = 'comment'
-                    ORDER BY k.display_order
-                    LIMIT {x_top}"""
-        )
-    ).cursor
-    column_names = [desc[0] for desc in cursor.description]
-    comments = [Item(**dict(zip(column_names, row))) for row in cursor.fetchall()]
-    for comment in comments:
-        if comment.text:
-            comment_text.append(comment.text)
-            if n_child > 0:
-                cursor = session.execute(
-                    text(
-                        f"""SELECT i.* FROM items i
-                                JOIN kids k ON i.id = k.kid
-                                WHERE k.item = {comment.id} AND i.type = 'comment'
-                                ORDER BY k.display_order
-                                LIMIT {n_child}"""
-                    )
-                ).cursor
-                child_row = cursor.fetchone()
-                if child_row:
-                    child_comment = Item(**dict(zip(column_names, child_row)))
-                    if child_comment.text:
-                        comment_text.append(child_comment.text)
+async def get_comments_text(session, story_id, x_top=3, n_child=1):
+    comment_text = await get_comments_text_batch(session, [story_id], x_top, n_child)
+    return comment_text.get(story_id, [])
+
+
+# Same as get_comments_text but for many stories at once: two batched queries
+# (one for top-level comments, one for their children) instead of O(stories)
+async def get_comments_text_batch(session, story_ids, x_top=3, n_child=1):
+    comment_text = {story_id: [] for story_id in story_ids}
+    if not story_ids or x_top <= 0:
+        return comment_text
+
+    comments = await _fetch_kid_comments(session, story_ids, x_top)
+
+    children = {}
+    if n_child > 0:
+        comment_ids = [
+            comment["id"]
+            for story_comments in comments.values()
+            for comment in story_comments
+            if comment["text"]
+        ]
+        if comment_ids:
+            children = await _fetch_kid_comments(session, comment_ids, n_child)
+
+    for story_id in story_ids:
+        for comment in comments.get(story_id, []):
+            if comment["text"]:
+                comment_text[story_id].append(comment["text"])
+                for child_comment in children.get(comment["id"], []):
+                    if child_comment["text"]:
+                        comment_text[story_id].append(child_comment["text"])
     return comment_text
 
 
 # Populate parts with the poll responses
-def get_poll_responses(session, items):
+async def get_poll_responses(session, items):
     polls = []
     for item in items:
         poll = copy.copy(item)
         if item.parts is not None:
             poll_parts = [int(part_id) for part_id in item.parts.split(",")]
             pollopts = (
-                session.query(Item.id, Item.type, Item.text, Item.score)
-                .filter(Item.id.in_(poll_parts))
-                .all()
-            )
+                await session.execute(
+                    select(Item.id, Item.type, Item.text, Item.score).where(
+                        Item.id.in_(poll_parts)
+                    )
+                )
+            ).fetchall()
             poll.parts = []
             for pollopt in pollopts:
                 if pollopt.text and pollopt.score:
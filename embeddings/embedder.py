@@ -104,8 +104,9 @@ class DocumentEmbedder:
         processed = []
         cursor = self.db_conn.cursor()
         for story_id in story_ids:
-            constraint = f"FROM items WHERE type = 'story' AND id = {story_id}"
-            cursor.execute(f"SELECT score, descendants {constraint}")
+            constraint = "FROM items WHERE type = 'story' AND id = ?"
+            params = (story_id,)
+            cursor.execute(f"SELECT score, descendants {constraint}", params)
             result = cursor.fetchone()
             if not result:
                 continue
@@ -115,7 +116,7 @@ class DocumentEmbedder:
             if score < self.MIN_SCORE or descendants < self.MIN_DESCENDANTS:
                 continue
             await self.process_stories_with_constraint(
-                constraint, progress, doc_progress, batch_size=1
+                constraint, params, progress, doc_progress, batch_size=1
             )
             processed.append(story_id)
 
@@ -125,16 +126,15 @@ class DocumentEmbedder:
 
     async def process_catchup_stories(self, offset=0):
         # Fetch all interesting stories
-        interesting = (
-            f"AND score >= {self.MIN_SCORE} AND descendants >= {self.MIN_DESCENDANTS}"
-        )
+        interesting = "AND score >= ? AND descendants >= ?"
         constraint = f"FROM items WHERE type = 'story' {interesting}"
+        params = (self.MIN_SCORE, self.MIN_DESCENDANTS)
 
         # Fetch the last processed story
         last_processed_story = self.fetch_last_processed_story()
 
         # Return the difference between the two lists
-        missing = self.find_missing(constraint)
+        missing = self.find_missing(constraint, params)
         if len(missing) > 0:
             log(
                 f"Found {len(missing)} missing stories, resetting last_processed_story ({last_processed_story})"
@@ -154,24 +154,27 @@ class DocumentEmbedder:
                 last_processed_story = cursor.fetchone()[0]
                 cursor.close()
             log(f"Resuming from story {last_processed_story} (after offset: {offset})")
-            constraint += f" AND id > {last_processed_story}"
+            constraint += " AND id > ?"
+            params += (last_processed_story,)
 
         cursor = self.db_conn.cursor()
-        cursor.execute(f"SELECT COUNT(*) {constraint}")
+        cursor.execute(f"SELECT COUNT(*) {constraint}", params)
         total_stories = cursor.fetchone()[0]
         cursor.close()
         log(f"Found total eligible discussions: {total_stories}")
         progress = tqdm(desc="parts processed")
         doc_progress = tqdm(desc="documents processed", total=total_stories)
 
-        await self.process_stories_with_constraint(constraint, progress, doc_progress)
+        await self.process_stories_with_constraint(
+            constraint, params, progress, doc_progress
+        )
         progress.close()
         doc_progress.close()
 
     async def process_stories_with_constraint(
-        self, constraint, progress, doc_progress, batch_size=BATCH_SIZE
+        self, constraint, params, progress, doc_progress, batch_size=BATCH_SIZE
     ):
-        story_iter = self.story_generator(constraint)
+        story_iter = self.story_generator(constraint, params)
         story_batch = []
 
         for story, comments in story_iter:
@@ -209,10 +212,10 @@ class DocumentEmbedder:
         self.embed_conn.commit()
         cursor.close()
 
-    def find_missing(self, constraint):
+    def find_missing(self, constraint, params=()):
         # Fetch list of ids from conn (items) table
         items_cursor = self.db_conn.cursor()
-        items_cursor.execute(f"SELECT COUNT(*) {constraint}")
+        items_cursor.execute(f"SELECT COUNT(*) {constraint}", params)
         items_count = items_cursor.fetchone()[0]
         log_with_mem(f"Found {items_count} interesting stories from items")
 
@@ -230,7 +233,7 @@ class DocumentEmbedder:
         # Find difference
         log_with_mem("Finding missing stories")
         items = set()
-        items_cursor.execute(f"SELECT id {constraint}")
+        items_cursor.execute(f"SELECT id {constraint}", params)
         for item in items_cursor.fetchall():
             items.add(item[0])
             item = items_cursor.fetchone()
@@ -248,9 +251,9 @@ class DocumentEmbedder:
         dt = datetime.datetime.fromtimestamp(unix_timestamp)
         return dt.strftime("%Y-%m-%d")
 
-    def story_generator(self, constraint):
+    def story_generator(self, constraint, params=()):
         cursor = self.db_conn.cursor()
-        cursor.execute(f"SELECT id, title, text, parent {constraint}")
+        cursor.execute(f"SELECT id, title, text, parent {constraint}", params)
         row = cursor.fetchone()
         while row:
             story = dict(row)
@@ -157,6 +157,10 @@ if __name__ == "__main__":
     db_path = os.path.expanduser(DB_PATH)
     db_conn = sqlite3.connect(db_path)
     db_conn.row_factory = sqlite3.Row
+    # Realtime sync refreshes rows with INSERT OR REPLACE; without this the
+    # REPLACE's implicit delete skips the items_fts delete trigger and the
+    # full-text index accumulates stale entries
+    db_conn.execute("PRAGMA recursive_triggers = ON")
 
     prefix = os.path.splitext(db_path)[0]
     embed_conn = sqlite3.connect(f"{prefix}_embeddings.db")
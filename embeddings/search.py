@@ -48,19 +48,25 @@ class Index:
 
     def update_embeddings(self, story_ids):
         # log_with_mem(f"updating {len(story_ids)} embeddings")
-        for story_id in story_ids:
-            self.index.remove_ids(np.array([story_id], dtype=np.int64))
-            new_embeddings, new_item_ids = self.load_embeddings(
-                f"WHERE story = {story_id}"
-            )
+        story_ids = list(story_ids)
+        if not story_ids:
+            return
+        # One remove, one load, and one add for the whole batch instead of
+        # a remove/load/add cycle per story
+        self.index.remove_ids(np.array(story_ids, dtype=np.int64))
+        placeholders = ", ".join("?" * len(story_ids))
+        new_embeddings, new_item_ids = self.load_embeddings(
+            f"WHERE story IN ({placeholders})", tuple(story_ids)
+        )
+        if len(new_item_ids) > 0:
             self.index.add_with_ids(new_embeddings, new_item_ids)
         # log_with_mem(f"updated faiss index!\n")
 
-    def load_embeddings(self, constraint=""):
+    def load_embeddings(self, constraint="", params=()):
         cursor = self.embed_conn.cursor()
 
         # Fetch the total number of embeddings
-        cursor.execute(f"SELECT COUNT(*) FROM embeddings {constraint}")
+        cursor.execute(f"SELECT COUNT(*) FROM embeddings {constraint}", params)
         num_embeddings = cursor.fetchone()[0]
 
         # Create an empty numpy array to hold the embeddings and item IDs
@@ -69,7 +75,7 @@ class Index:
 
         # Fetch all embeddings and their story/item IDs from the database and fill the numpy arrays
         cursor.execute(
-            f"SELECT story, embedding FROM embeddings {constraint} ORDER BY id"
+            f"SELECT story, embedding FROM embeddings {constraint} ORDER BY id", params
         )
         for i, (story_id, embedding) in enumerate(cursor.fetchall()):
             item_ids[i] = story_id
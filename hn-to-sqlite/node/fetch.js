@@ -137,6 +137,9 @@ async function main() {
     await exec("PRAGMA temp_store = MEMORY;");
     await exec("PRAGMA locking_mode = EXCLUSIVE;");
     await exec("PRAGMA mmap_size = 30000000000;");
+    // Make INSERT OR REPLACE fire the items_fts delete trigger on its
+    // implicit delete, keeping the full-text index in sync
+    await exec("PRAGMA recursive_triggers = ON;");
 
     const bar = new ProgressBar("Processing [:bar] :current/:total :percent :rate :elapsed/:etas", {
         total: itemIds.length,
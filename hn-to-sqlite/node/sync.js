@@ -17,6 +17,9 @@ const app = initializeApp(firebaseConfig);
 const dbRef = ref(getDatabase(app));
 
 const db = new sqlite3.Database(DB_PATH);
+// INSERT OR REPLACE must fire the items_fts delete trigger on the implicit
+// delete, or the full-text index accumulates stale entries
+db.run("PRAGMA recursive_triggers = ON;");
 const insertItem = promisify(db.run).bind(db);
 const insertKid = promisify(db.run).bind(db);
 const insertUser = promisify(db.run).bind(db);
@@ -51,6 +51,48 @@ async def create_tables(db):
     ):
         await db.commit()
 
+    # Indexes backing the API server's filter/sort predicates
+    for index in (
+        "CREATE INDEX IF NOT EXISTS ix_items_type_score ON items (type, score);",
+        "CREATE INDEX IF NOT EXISTS ix_items_type_time ON items (type, time);",
+        "CREATE INDEX IF NOT EXISTS ix_items_by ON items (by);",
+        "CREATE INDEX IF NOT EXISTS ix_kids_item_order ON kids (item, display_order);",
+    ):
+        async with db.execute(index):
+            await db.commit()
+
+    # Full-text index over titles and text, kept in sync by triggers, so the
+    # API server can answer substring searches without scanning items
+    for statement in (
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+            title, text, content='items', content_rowid='id'
+        );
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS items_fts_ai AFTER INSERT ON items BEGIN
+            INSERT INTO items_fts(rowid, title, text)
+                VALUES (new.id, new.title, new.text);
+        END;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS items_fts_ad AFTER DELETE ON items BEGIN
+            INSERT INTO items_fts(items_fts, rowid, title, text)
+                VALUES ('delete', old.id, old.title, old.text);
+        END;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS items_fts_au AFTER UPDATE ON items BEGIN
+            INSERT INTO items_fts(items_fts, rowid, title, text)
+                VALUES ('delete', old.id, old.title, old.text);
+            INSERT INTO items_fts(rowid, title, text)
+                VALUES (new.id, new.title, new.text);
+        END;
+        """,
+    ):
+        async with db.execute(statement):
+            await db.commit()
+
 
 async def main():
     async with aiosqlite.connect("hn_data.db") as db: